@@ -0,0 +1,113 @@
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LIST_COLUMNS = "id,subject,status,created_at"
+REPLY_COLUMNS = LIST_COLUMNS + ",ai_reply"
+EXCERPT_LENGTH = 180
+MAX_PAGE = 50
+
+
+def today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def recent_activity(supabase, email, before=None, limit=10, with_reply=False):
+    """One keyset page of a user's activity_logs, newest first; pass the returned `next` as `before`."""
+    limit = max(1, min(int(limit), MAX_PAGE))
+    query = supabase.table("activity_logs").select(REPLY_COLUMNS if with_reply else LIST_COLUMNS).eq("email", email)
+    if before:
+        query = query.lt("id", int(before))
+    items = query.order("id", desc=True).limit(limit).execute().data
+    for item in items:
+        if with_reply:
+            item["excerpt"] = (item.pop("ai_reply") or "")[:EXCERPT_LENGTH]
+    return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
+
+
+class ActivityStats:
+    """Per-user totals, SENT, FAILED and today counts for the dashboard.
+
+    Counters live in the activity_stats table (one row per email) so a page
+    view is a single primary-key read. The process writing a user's logs
+    seeds its counters once from count queries, bumps them from the
+    write-behind hook and upserts the absolute values back. When the
+    process stops owning a user (its scan shard moved) forget() drops the
+    cached counters, so the next owner's values are never overwritten by
+    stale ones.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, email, **filters):
+        query = self.supabase.table("activity_logs").select("id", count="exact", head=True).eq("email", email)
+        for op, (column, value) in filters.items():
+            query = getattr(query, op)(column, value)
+        return query.execute().count or 0
+
+    def _seed(self, email):
+        return {
+            "email": email,
+            "day": today(),
+            "total": self._count(email),
+            "sent": self._count(email, eq=("status", "SENT")),
+            "failed": self._count(email, eq=("status", "FAILED")),
+            "today": self._count(email, gte=("created_at", today())),
+        }
+
+    def record(self, rows):
+        day = today()
+        changed, seeded = {}, set()
+        for row in rows:
+            email = row["email"]
+            if email in seeded:
+                continue
+            with self._lock:
+                counters = self._counters.get(email)
+            if counters is None:
+                # Seeded after the insert landed, so the counts already include this whole batch.
+                counters = self._seed(email)
+                seeded.add(email)
+                with self._lock:
+                    self._counters[email] = counters
+            else:
+                with self._lock:
+                    if counters["day"] != day:
+                        counters.update(day=day, today=0)
+                    counters["total"] += 1
+                    counters["today"] += 1
+                    if row.get("status") == "SENT":
+                        counters["sent"] += 1
+                    elif row.get("status") == "FAILED":
+                        counters["failed"] += 1
+            changed[email] = counters
+        if changed:
+            self.supabase.table("activity_stats").upsert([dict(c) for c in changed.values()], on_conflict="email").execute()
+
+    def forget(self, match):
+        """Drop cached counters for every email where match(email) is true."""
+        with self._lock:
+            for email in [e for e in self._counters if match(e)]:
+                del self._counters[email]
+
+    def get(self, email):
+        try:
+            res = self.supabase.table("activity_stats").select("total,sent,failed,today,day").eq("email", email).limit(1).execute()
+            if res.data:
+                stats = res.data[0]
+            else:
+                stats = self._seed(email)
+                # Save the seed so later views are a single read; a row the writer created meanwhile wins.
+                self.supabase.table("activity_stats").upsert(dict(stats), on_conflict="email", ignore_duplicates=True).execute()
+        except Exception as e:
+            logger.error(f"Stats error: {e}")
+            stats = {"total": 0, "sent": 0, "failed": 0, "today": 0, "day": today()}
+        if stats["day"] != today():
+            stats["today"] = 0
+        stats["percentage"] = round(100 * stats["sent"] / stats["total"]) if stats["total"] else 0
+        return stats
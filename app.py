@@ -1,46 +1,28 @@
 import os
 import sys
+import time
 import logging
-from flask import Flask, render_template, redirect, url_for, session, request, send_file, flash, jsonify
+import threading
+from flask import Flask, render_template, redirect, url_for, session, request, send_file, flash, jsonify, Response
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
 
-try:
-    from supabase import create_client
-    from google_auth_oauthlib.flow import Flow
-    from googleapiclient.discovery import build
-    from google.oauth2.credentials import Credentials
-    import google.generativeai as genai
-    from apscheduler.schedulers.background import BackgroundScheduler
-    from gtts import gTTS
-    import base64
-    from email.message import EmailMessage
-    import io
-    logger.info("All dependencies loaded successfully")
-except ImportError as e:
-    logger.error(f"Import error: {e}")
-    sys.exit(1)
+import io
+import services
+from activity import recent_activity
+from metrics import registry as metrics
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key-12345")
 app.config.update(SESSION_COOKIE_SECURE=True, SESSION_COOKIE_SAMESITE='None')
 
-try:
-    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    logger.info("Supabase and Gemini configured")
-except Exception as e:
-    logger.error(f"Configuration error: {e}")
-    sys.exit(1)
-
 LANGUAGES = {
     'en': {'dash': 'Dashboard', 'conn': 'Connect', 'pend': 'Pending', 'sett': 'Settings', 'scan': 'Force Scan', 'dir': 'ltr', 'opt': 'Optimized', 'scn': 'Scanner', 'stat': 'Status', 'act': 'Active', 'app': 'App', 'lang': 'Language', 'rec': 'Recent', 'resp': 'Response', 'tone': 'Tone', 'prof': 'Professional', 'logs': 'Logs', 'fri': 'Friendly', 'no': 'No', 'save': 'Save', 'all': 'All', 'chng': 'Changes', 'acty': 'Activity', 'cust': 'Customize', 'yet': 'Yet', 'how': 'How', 'go': 'Go', 'erne': 'Ernesco', 'is': 'Is', 'int': 'Interacts', 'tot': 'Total', 'wit': 'With', 'real': 'Real', 'time': 'Time', 'email': 'Email', 'perf': 'Performance', 'proc': 'Processed', 'tdy': 'Today', 'bg': 'Background', 'sys': 'System', 'prog': 'Progress', 'ai': 'AI', 'ana': 'Analyses'},
     'sw': {'dash': 'Dashibodi', 'conn': 'Unganisha', 'pend': 'Inasubiri', 'sett': 'Mipangilio', 'scan': 'Anza Sasa', 'dir': 'ltr', 'opt': 'Imeboreswa', 'scn': 'Skana', 'stat': 'Hali', 'act': 'Amilifu', 'app': 'Programu', 'lang': 'Lugha', 'rec': 'Nyingi', 'resp': 'Jibu', 'tone': 'Sauti', 'prof': 'Kitaalamu', 'logs': 'Orodha', 'fri': 'Karibu', 'no': 'Hapana', 'save': 'Hifadhi', 'all': 'Yote', 'chng': 'Mabadiliko', 'acty': 'Shughuli', 'cust': 'Kamaata', 'yet': 'Bado', 'how': 'Jinsi', 'go': 'Jifanya', 'erne': 'Ernesco', 'is': 'Ni', 'int': 'Ushirikiano', 'tot': 'Jumla', 'wit': 'Na', 'real': 'Halisi', 'time': 'Wakati', 'email': 'Barua', 'perf': 'Utendaji', 'proc': 'Kumprocessia', 'tdy': 'Leo', 'bg': 'Msingi', 'sys': 'Mfumo', 'prog': 'Maendeleo', 'ai': 'AI', 'ana': 'Uchambuzi'},
@@ -58,71 +40,35 @@ LANGUAGES = {
     'ko': {'dash': '대시보드', 'conn': '연결', 'pend': '대기 중', 'sett': '설정', 'scan': '지금 스캔', 'dir': 'ltr', 'opt': '최적화됨', 'scn': '스캔', 'stat': '상태', 'act': '활성', 'app': '앱', 'lang': '언어', 'rec': '최근', 'resp': '응답', 'tone': '톤', 'prof': '전문가', 'logs': '로그', 'fri': '친절함', 'no': '아니', 'save': '저장', 'all': '모두', 'chng': '변경사항', 'acty': '활동', 'cust': '사용자 정의', 'yet': '아직', 'how': '어떻게', 'go': '이동', 'erne': 'Ernesco', 'is': '입니다', 'int': '상호작용', 'tot': '총계', 'wit': '함께', 'real': '실시간', 'time': '시간', 'email': '이메일', 'perf': '성능', 'proc': '처리됨', 'tdy': '오늘', 'bg': '배경', 'sys': '시스템', 'prog': '진행률', 'ai': 'AI', 'ana': '분석'}
 }
 
+# Built once at import: every language falls back to English per key, so a request is a single dict lookup.
+TRANSLATIONS = {code: {**LANGUAGES['en'], **table} for code, table in LANGUAGES.items()}
+DEFAULT_TRANSLATION = TRANSLATIONS['en']
+
 @app.context_processor
 def inject_translations():
-    user_lang = session.get('language', 'en')
-    return {'t': LANGUAGES.get(user_lang, LANGUAGES['en'])}
+    return {'t': TRANSLATIONS.get(session.get('language', 'en'), DEFAULT_TRANSLATION)}
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.send', 'https://www.googleapis.com/auth/userinfo.email', 'openid']
 CLIENT_CONFIG = {"web": {"client_id": os.getenv("GOOGLE_CLIENT_ID"), "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"), "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token"}}
 REDIRECT_URI = "https://ernesco.onrender.com/callback"
 
-def send_gmail_reply(service, thread_id, msg_id, to_email, subject, body):
-    try:
-        message = EmailMessage()
-        message.set_content(body)
-        message['To'] = to_email
-        message['Subject'] = subject if subject.lower().startswith("re:") else f"Re: {subject}"
-        message['In-Reply-To'] = msg_id
-        message['References'] = msg_id
-        raw_msg = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        service.users().messages().send(userId="me", body={'raw': raw_msg, 'threadId': thread_id}).execute()
-        return True
-    except Exception as e:
-        logger.error(f"Send Error: {e}")
-        return False
-
-def scan_inboxes_and_reply():
-    try:
-        users = supabase.table("profiles").select("*").execute()
-        for user in users.data:
-            if not user.get('access_token'): continue
-            lang = user.get('language', 'en')
-            tone = user.get('tone', 'professional')
-            creds = Credentials(token=user['access_token'], refresh_token=user['refresh_token'], token_uri="https://oauth2.googleapis.com/token", client_id=os.getenv("GOOGLE_CLIENT_ID"), client_secret=os.getenv("GOOGLE_CLIENT_SECRET"))
-            service = build("gmail", "v1", credentials=creds)
-            results = service.users().messages().list(userId="me", q="is:unread", maxResults=5).execute()
-            for msg in results.get("messages", []):
-                try:
-                    m = service.users().messages().get(userId='me', id=msg['id']).execute()
-                    headers = m.get('payload', {}).get('headers', [])
-                    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-                    sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
-                    msg_id = next((h['value'] for h in headers if h['name'] == 'Message-ID'), "")
-                    prompt = f"Draft a short {tone} email reply. Write the response entirely in {lang}. Email snippet: {m.get('snippet', '')}"
-                    response = model.generate_content(prompt)
-                    success = send_gmail_reply(service, m['threadId'], msg_id, sender, subject, response.text)
-                    status_text = "SENT" if success else "FAILED"
-                    supabase.table("activity_logs").insert({"email": user['email'], "subject": subject, "ai_reply": response.text, "status": status_text}).execute()
-                    service.users().messages().batchModify(userId='me', body={'ids': [msg['id']], 'removeLabelIds': ['UNREAD']}).execute()
-                except Exception as e:
-                    logger.error(f"Msg error: {e}")
-    except Exception as e:
-        logger.error(f"Global error: {e}")
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=scan_inboxes_and_reply, trigger="interval", seconds=300)
-scheduler.start()
+# Scans normally run in the separate worker process (worker.py); single-process deployments can opt back in.
+if os.getenv("EMBEDDED_SCANNER") == "1":
+    def _start_embedded_scanner():
+        import worker
+        worker.start_background()
+    threading.Thread(target=_start_embedded_scanner, name="embedded-scanner", daemon=True).start()
 
 @app.route('/')
 def index():
-    emails = []
+    emails, counters = [], {}
     if session.get('logged_in'):
         try:
-            emails = supabase.table("activity_logs").select("*").order("created_at", desc=True).limit(10).execute().data
-        except:
-            pass
-    return render_template('index.html', logged_in=session.get('logged_in'), emails=emails)
+            emails = recent_activity(services.supabase(), session.get("user_email"), limit=10, with_reply=True)["items"]
+            counters = services.stats().get(session.get("user_email"))
+        except Exception as e:
+            logger.error(f"Index error: {e}")
+    return render_template('index.html', logged_in=session.get('logged_in'), emails=emails, stats=counters)
 
 @app.route('/connect')
 def connect_email():
@@ -134,16 +80,24 @@ def connect_email():
 def pending_actions():
     if not session.get("logged_in"):
         return redirect(url_for("login"))
-    count, sent_count, emails = 0, 0, []
+    counters, emails = {}, []
+    try:
+        counters = services.stats().get(session.get("user_email"))
+        emails = recent_activity(services.supabase(), session.get("user_email"), limit=5)["items"]
+    except Exception as e:
+        logger.error(f"Pending error: {e}")
+    return render_template('pending_actions.html', count=counters.get("total", 0), sent_count=counters.get("sent", 0), working_on=len(emails), percentage=counters.get("percentage", 0), emails=emails)
+
+@app.route('/api/activity')
+def activity_api():
+    if not session.get("logged_in"):
+        return jsonify({'error': 'Unauthorized'}), 401
     try:
-        res = supabase.table("activity_logs").select("*", count="exact").execute()
-        count = res.count or 0
-        sent_res = supabase.table("activity_logs").select("*", count="exact").eq("status", "SENT").execute()
-        sent_count = sent_res.count or 0
-        emails = res.data[:5]
-    except:
-        pass
-    return render_template('pending_actions.html', count=count, sent_count=sent_count, working_on=len(emails), percentage=75, emails=emails)
+        page = recent_activity(services.supabase(), session.get("user_email"), before=request.args.get('before', type=int), limit=request.args.get('limit', 10, type=int), with_reply=request.args.get('reply') == '1')
+        return jsonify(page)
+    except Exception as e:
+        logger.error(f"Activity error: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -154,11 +108,8 @@ def settings():
         tone = request.form.get('tone', 'professional')
         session['language'] = lang
         session['tone'] = tone
-        try:
-            supabase.table("profiles").update({"language": lang, "tone": tone}).eq("email", session.get("user_email")).execute()
-            flash("Preferences Saved!", "success")
-        except:
-            pass
+        services.profiles().update({"language": lang, "tone": tone}, {"email": session.get("user_email")})
+        flash("Preferences Saved!", "success")
         return redirect(url_for('settings'))
     return render_template('settings.html')
 
@@ -166,21 +117,33 @@ def settings():
 def listen(log_id):
     if not session.get("logged_in"):
         return "Unauthorized", 401
+    ref = (session.get("user_email"), log_id, session.get('language', 'en'))
+    audio = services.audio()
+    known = audio.known_key(ref)
+    if known and request.if_none_match.contains(known):
+        resp = app.response_class(status=304)
+        resp.set_etag(known)
+        return resp
     try:
-        res = supabase.table("activity_logs").select("ai_reply").eq("id", log_id).execute()
+        res = services.supabase().table("activity_logs").select("ai_reply").eq("id", log_id).eq("email", session.get("user_email")).execute()
         if not res.data:
             return "Log not found", 404
-        tts = gTTS(text=res.data[0]['ai_reply'], lang=session.get('language', 'en'))
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        fp.seek(0)
-        return send_file(fp, mimetype='audio/mpeg')
+        started = time.perf_counter()
+        key, data, source = audio.get(res.data[0]['ai_reply'], ref[2])
+        audio.remember(ref, key)
+        resp = send_file(io.BytesIO(data), mimetype='audio/mpeg', conditional=True, etag=key, max_age=86400)
+        resp.cache_control.public = False
+        resp.cache_control.private = True
+        resp.headers['X-Audio-Cache'] = source
+        resp.headers['Server-Timing'] = f"tts;desc={source};dur={(time.perf_counter() - started) * 1000:.1f}"
+        return resp
     except Exception as e:
         logger.error(f"Listen error: {e}")
         return f"Error: {e}", 500
 
 @app.route('/login')
 def login():
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_config(CLIENT_CONFIG, scopes=SCOPES, redirect_uri=REDIRECT_URI)
     auth_url, state = flow.authorization_url(access_type='offline', prompt='consent', include_granted_scopes='true')
     session['state'] = state
@@ -188,15 +151,19 @@ def login():
 
 @app.route('/callback')
 def callback():
+    from google_auth_oauthlib.flow import Flow
+    from gmail_clients import build_service
     try:
         flow = Flow.from_client_config(CLIENT_CONFIG, scopes=SCOPES, state=session.get('state'))
         flow.redirect_uri = REDIRECT_URI
         flow.fetch_token(authorization_response=request.url.replace('http:', 'https:'))
         creds = flow.credentials
-        user_info = build('oauth2', 'v2', credentials=creds).userinfo().get().execute()
+        user_info = build_service('oauth2', 'v2', creds).userinfo().get().execute()
         session["user_name"] = user_info.get("given_name", "User").upper()
         session["user_email"] = user_info["email"]
-        supabase.table("profiles").upsert({"email": user_info["email"], "access_token": creds.token, "refresh_token": creds.refresh_token}, on_conflict="email").execute()
+        services.supabase().table("profiles").upsert({"email": user_info["email"], "access_token": creds.token, "refresh_token": creds.refresh_token}, on_conflict="email").execute()
+        if services.created("scanner"):
+            services.created("scanner").clients.put(user_info["email"], creds)
         session["logged_in"] = True
         return redirect(url_for("index"))
     except Exception as e:
@@ -210,13 +177,23 @@ def logout():
 
 @app.route('/force-scan')
 def force_scan():
-    scan_inboxes_and_reply()
-    flash("Manual Scan Complete", "success")
+    if not session.get("logged_in"):
+        return redirect(url_for("login"))
+    try:
+        services.coordinator().enqueue(session.get("user_email"))
+        flash("Scan queued", "success")
+    except Exception as e:
+        logger.error(f"Force scan error: {e}")
+        flash("Could not queue scan", "error")
     return redirect(url_for('index'))
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy', 'app': 'Ernesco AI Assistant'})
+    return jsonify({'status': 'healthy', 'app': 'Ernesco AI Assistant', **services.status()})
 
 if __name__ == '__main__':
     try:
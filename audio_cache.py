@@ -0,0 +1,169 @@
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def render_mp3(text, lang):
+    from gtts import gTTS
+    fp = io.BytesIO()
+    gTTS(text=text, lang=lang).write_to_fp(fp)
+    return fp.getvalue()
+
+
+class AudioCache:
+    """Content-addressed MP3 cache: an in-memory LRU over a size-capped directory.
+
+    Entries are keyed by sha256(language, text), so the key doubles as a
+    strong ETag. Renders for the same key are coalesced, and prerender()
+    queues a render on a small background pool.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, memory_items=None, workers=2, render=render_mp3):
+        self.directory = directory or os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+        self.max_bytes = max_bytes or int(os.getenv("AUDIO_CACHE_MAX_MB", 256)) * 1024 * 1024
+        self.memory_items = memory_items or int(os.getenv("AUDIO_CACHE_MEMORY_ITEMS", 64))
+        self.render = render
+        os.makedirs(self.directory, exist_ok=True)
+        self._memory = OrderedDict()
+        self._refs = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self._disk_bytes = sum(e.stat().st_size for e in os.scandir(self.directory) if e.name.endswith(".mp3"))
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "prerenders": 0, "errors": 0, "evictions": 0, "cold_requests": 0, "warm_requests": 0, "cold_seconds": 0.0, "warm_seconds": 0.0}
+
+    @staticmethod
+    def key(text, lang):
+        return hashlib.sha256(f"{lang}\0{text}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, text, lang):
+        """Return (key, mp3 bytes, source) where source is memory, disk or render."""
+        started = time.perf_counter()
+        key = self.key(text, lang)
+        data, source = self._lookup(key)
+        if data is None:
+            data, source = self._render(key, text, lang), "render"
+        elapsed = time.perf_counter() - started
+        kind = "cold" if source == "render" else "warm"
+        with self._lock:
+            self._stats[f"{kind}_requests"] += 1
+            self._stats[f"{kind}_seconds"] += elapsed
+        return key, data, source
+
+    def prerender(self, text, lang):
+        key = self.key(text, lang)
+        if key in self._memory or os.path.exists(self._path(key)):
+            return
+        with self._lock:
+            self._stats["prerenders"] += 1
+        self._pool.submit(self._render, key, text, lang).add_done_callback(lambda f: f.exception())
+
+    def _lookup(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return data, "memory"
+        try:
+            with open(self._path(key), "rb") as fp:
+                data = fp.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return None, None
+        self._remember_bytes(key, data)
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        return data, "disk"
+
+    def _render(self, key, text, lang):
+        with self._lock:
+            leader = key not in self._inflight
+            if leader:
+                self._inflight[key] = Future()
+            future = self._inflight[key]
+        if not leader:
+            return future.result()
+        try:
+            data = self.render(text, lang)
+            self._store(key, data)
+            with self._lock:
+                self._stats["renders"] += 1
+            future.set_result(data)
+            return data
+        except Exception as e:
+            logger.error(f"TTS error: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _store(self, key, data):
+        tmp = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, self._path(key))
+        self._remember_bytes(key, data)
+        with self._lock:
+            self._disk_bytes += len(data)
+            over = self._disk_bytes > self.max_bytes
+        if over:
+            self._evict_disk()
+
+    def _remember_bytes(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # Reads touch the file, so oldest mtime first is least recently used.
+        entries = sorted((e for e in os.scandir(self.directory) if e.name.endswith(".mp3")), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def remember(self, ref, key):
+        """Map a caller reference (e.g. a log id) to its key so revalidation can skip the lookup."""
+        with self._lock:
+            self._refs[ref] = key
+            self._refs.move_to_end(ref)
+            while len(self._refs) > 4096:
+                self._refs.popitem(last=False)
+
+    def known_key(self, ref):
+        return self._refs.get(ref)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s.update(memory_items=len(self._memory), disk_bytes=self._disk_bytes)
+        for kind in ("cold", "warm"):
+            seconds, count = s.pop(f"{kind}_seconds"), s[f"{kind}_requests"]
+            s[f"avg_{kind}_ms"] = round(1000 * seconds / count, 2) if count else 0.0
+        return s
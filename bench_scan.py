@@ -0,0 +1,201 @@
+"""Offline scan benchmark: N users x M messages against fake Gmail, Gemini and Supabase.
+
+    python bench_scan.py --users 50 --messages 10 --gmail-latency 0.05 --gemini-latency 0.4
+
+Each fake sleeps for its configured latency (with +/-25% jitter) and fails
+at its configured rate, so pipeline changes can be compared without
+network access or credentials.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+from scanner import Scanner, ScanEngine, ScanLimits
+from gemini_service import GenerationService
+from write_behind import WriteBehindSink
+from metrics import registry as metrics
+
+
+class Upstream:
+    def __init__(self, latency, failure_rate, error=ConnectionError):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def hit(self, name):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency * random.uniform(0.75, 1.25))
+        if random.random() < self.failure_rate:
+            raise self.error(f"fake {name} failure")
+
+
+class FakeRequest:
+    def __init__(self, upstream, name, result):
+        self.upstream, self.name, self.result = upstream, name, result
+
+    def execute(self, http=None):
+        self.upstream.hit(self.name)
+        return self.result() if callable(self.result) else self.result
+
+
+class FakeBatch:
+    def __init__(self, upstream, callback):
+        self.upstream, self.callback, self.requests = upstream, callback, []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        self.upstream.hit("batch")
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result, None)
+
+
+class FakeMailbox:
+    def __init__(self, email, messages, upstream, duplicate_rate):
+        self.upstream = upstream
+        self.messages = {}
+        for i in range(messages):
+            snippet = "Weekly newsletter" if random.random() < duplicate_rate else f"Question {i} from {email}"
+            self.messages[f"{email}-{i}"] = {"id": f"{email}-{i}", "threadId": f"t{i}", "labelIds": ["INBOX", "UNREAD"], "snippet": snippet,
+                                             "payload": {"headers": [{"name": "Subject", "value": f"Subject {i}"}, {"name": "From", "value": "sender@example.com"}, {"name": "Message-ID", "value": f"<{i}@example.com>"}]}}
+
+    def unread(self):
+        return [m["id"] for m in self.messages.values() if "UNREAD" in m["labelIds"]]
+
+    def modify(self, body):
+        for msg_id in body["ids"]:
+            self.messages[msg_id]["labelIds"] = [label for label in self.messages[msg_id]["labelIds"] if label not in body["removeLabelIds"]]
+        return {}
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self.upstream, callback)
+
+    def users(self):
+        up = self.upstream
+        messages = SimpleNamespace(
+            list=lambda **kw: FakeRequest(up, "list", lambda: {"messages": [{"id": i} for i in self.unread()[:kw.get("maxResults", 100)]]}),
+            get=lambda userId, id: FakeRequest(up, "get", dict(self.messages[id])),
+            send=lambda userId, body: FakeRequest(up, "send", {}),
+            batchModify=lambda userId, body: FakeRequest(up, "modify", lambda: self.modify(body)),
+        )
+        history = SimpleNamespace(list=lambda **kw: FakeRequest(up, "history", lambda: {"history": [{"messagesAdded": [{"message": {"id": i, "labelIds": ["INBOX", "UNREAD"]}}]} for i in self.unread()], "historyId": "2"}))
+        return SimpleNamespace(messages=lambda: messages, history=lambda: history, getProfile=lambda userId: FakeRequest(up, "profile", {"historyId": "1"}))
+
+
+class FakeClients:
+    def __init__(self, mailboxes):
+        self.mailboxes = mailboxes
+
+    def get(self, user):
+        return SimpleNamespace(email=user["email"], service=self.mailboxes[user["email"]], http=lambda: None)
+
+    def persist_token(self, client):
+        pass
+
+
+class FakeModel:
+    def __init__(self, upstream):
+        self.upstream = upstream
+
+    def generate_content(self, prompt):
+        self.upstream.hit("generate")
+        return SimpleNamespace(text=f"Thanks for your email. ({len(prompt)} chars)")
+
+
+class FakeQuery:
+    def __init__(self, supabase, table):
+        self.supabase, self.table = supabase, table
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.supabase.upstream.hit(self.table)
+        return SimpleNamespace(data=self.supabase.users if self.table == "profiles" else [], count=0)
+
+
+class FakeSupabase:
+    def __init__(self, users, upstream):
+        self.users, self.upstream = users, upstream
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def run(args):
+    random.seed(args.seed)
+    gmail = Upstream(args.gmail_latency, args.gmail_failure_rate)
+    gemini = Upstream(args.gemini_latency, args.gemini_failure_rate, api_exceptions.ServiceUnavailable)
+    db = Upstream(args.supabase_latency, args.supabase_failure_rate)
+    users = [{"email": f"user{i}@example.com", "access_token": "token", "refresh_token": "refresh", "history_id": "1", "language": "en", "tone": "professional"} for i in range(args.users)]
+    mailboxes = {u["email"]: FakeMailbox(u["email"], args.messages, gmail, args.duplicate_rate) for u in users}
+    supabase = FakeSupabase(users, db)
+    limits = ScanLimits(max_users=args.max_users, max_workers=args.max_workers, per_user=args.per_user, gmail=args.gmail_concurrency, gemini=args.gemini_concurrency, supabase=args.supabase_concurrency, user_timeout=args.timeout, pass_timeout=args.timeout)
+    engine = ScanEngine(limits)
+    with tempfile.TemporaryDirectory(prefix="bench-spill-") as spill_dir:
+        logs = WriteBehindSink(supabase, "activity_logs", spill_dir=spill_dir)
+        profiles = WriteBehindSink(supabase, "profiles", spill_dir=spill_dir)
+        generator = GenerationService(FakeModel(gemini), rpm=args.gemini_rpm, tpm=10 ** 9, backoff=0.05, upstream=lambda: engine.upstream("gemini"))
+        scanner = Scanner(supabase, None, engine=engine, clients=FakeClients(mailboxes), generator=generator, logs=logs, profiles=profiles)
+
+        metrics.reset()
+        started = time.perf_counter()
+        summary = scanner.scan_all()
+        # Close inside the directory so the final flush (and any spill) lands before it is removed.
+        logs.close()
+        profiles.close()
+        engine.shutdown()
+    wall = time.perf_counter() - started
+    return {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "processed": summary["messages"],
+        "sent": sum(r["sent"] for r in summary["users"]),
+        "failed": sum(r["failed"] for r in summary["users"]),
+        "user_errors": sum(1 for r in summary["users"] if r["status"] != "ok"),
+        "scan_seconds": summary["duration"],
+        "wall_seconds": round(wall, 3),
+        "throughput": summary["throughput"],
+        "upstream_calls": {"gmail": gmail.calls, "gemini": gemini.calls, "supabase": db.calls},
+        "gemini": generator.stats(),
+        "stages": {name: {"count": s["count"], "avg_ms": round(1000 * s["avg"], 2)} for name, s in sorted(metrics.snapshot().items())},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--gmail-latency", type=float, default=0.05)
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.03)
+    parser.add_argument("--gmail-failure-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0)
+    parser.add_argument("--supabase-failure-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="share of messages with an identical newsletter snippet")
+    parser.add_argument("--max-users", type=int, default=8)
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--per-user", type=int, default=4)
+    parser.add_argument("--gmail-concurrency", type=int, default=8)
+    parser.add_argument("--gemini-concurrency", type=int, default=4)
+    parser.add_argument("--supabase-concurrency", type=int, default=8)
+    parser.add_argument("--gemini-rpm", type=float, default=100000)
+    parser.add_argument("--timeout", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    json.dump(run(parse_args()), sys.stdout, indent=2)
+    print()
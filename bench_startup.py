@@ -0,0 +1,78 @@
+"""Startup benchmark: import time and time-to-first-response for the web and worker processes.
+
+    python bench_startup.py --runs 5
+
+Every run starts a fresh interpreter in a scratch directory with a local
+SQLite lease store and placeholder credentials, so nothing touches the
+network. The web probe imports app.py and serves GET /health; the worker
+probe imports worker.py, builds the scan pipeline, takes its first shard
+leases and serves /metrics.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ("google.generativeai", "googleapiclient", "supabase", "gtts", "apscheduler")
+
+PROBES = {
+    "web": """
+import time, sys, json
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+status = app.app.test_client().get('/health').status_code
+t2 = time.perf_counter()
+""",
+    "worker": """
+import time, sys, json
+t0 = time.perf_counter()
+import worker
+t1 = time.perf_counter()
+from apscheduler.schedulers.background import BackgroundScheduler
+coordinator = worker.start(BackgroundScheduler())
+coordinator.heartbeat()
+body = []
+worker.metrics_app({"PATH_INFO": "/metrics"}, lambda code, headers: body.append(code))
+status = int(body[0].split()[0])
+t2 = time.perf_counter()
+""",
+}
+
+REPORT = """
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"import_s": t1 - t0, "first_response_s": t2 - t0, "status": status, "modules": len(sys.modules), "heavy_loaded": heavy}))
+""" % (HEAVY,)
+
+
+def probe(kind):
+    env = dict(os.environ, PYTHONPATH=ROOT, SCAN_LEASE_DB=":memory:", LOG_LEVEL="WARNING", SUPABASE_URL="https://bench.supabase.co", SUPABASE_KEY="bench.bench.bench", GEMINI_API_KEY="bench")
+    env.pop("EMBEDDED_SCANNER", None)
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as cwd:
+        out = subprocess.run([sys.executable, "-W", "ignore", "-c", PROBES[kind] + REPORT], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(runs):
+    report = {}
+    for kind in PROBES:
+        samples = [probe(kind) for _ in range(runs)]
+        report[kind] = {
+            "import_ms": round(1000 * statistics.median(s["import_s"] for s in samples), 1),
+            "first_response_ms": round(1000 * statistics.median(s["first_response_s"] for s in samples), 1),
+            "status": samples[-1]["status"],
+            "modules": samples[-1]["modules"],
+            "heavy_loaded": samples[-1]["heavy_loaded"],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    json.dump(run(parser.parse_args().runs), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,168 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+from google.api_core import exceptions as api_exceptions
+
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE = (api_exceptions.ResourceExhausted, api_exceptions.ServiceUnavailable, api_exceptions.DeadlineExceeded, api_exceptions.InternalServerError, ConnectionError, TimeoutError)
+
+
+def build_prompt(tone, lang, snippet):
+    return f"Draft a short {tone} email reply. Write the response entirely in {lang}. Email snippet: {snippet}"
+
+
+class TokenBucket:
+    """Refills `per_minute` tokens a minute up to `per_minute`; acquire() blocks until enough are available."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ReplyCache:
+    """LRU of generated replies with a per-entry TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class GenerationService:
+    """Front for the Gemini model: reply cache, in-flight dedup, RPM/TPM buckets and retries.
+
+    `upstream` is an optional context-manager factory held only around the
+    actual model call, so cache hits never take a Gemini concurrency slot.
+    """
+
+    def __init__(self, model, rpm=None, tpm=None, ttl=None, max_entries=None, retries=None, backoff=None, output_tokens=None, upstream=None):
+        env = lambda name, default: float(os.getenv(name, default))
+        self.model = model
+        self.requests = TokenBucket(rpm or env("GEMINI_RPM", 15))
+        self.tokens = TokenBucket(tpm or env("GEMINI_TPM", 1000000))
+        self.cache = ReplyCache(int(max_entries or env("GEMINI_CACHE_SIZE", 2048)), ttl or env("GEMINI_CACHE_TTL", 6 * 3600))
+        self.retries = int(retries if retries is not None else env("GEMINI_RETRIES", 4))
+        self.backoff = backoff if backoff is not None else env("GEMINI_BACKOFF", 2.0)
+        self.output_tokens = int(output_tokens or env("GEMINI_OUTPUT_TOKENS", 256))
+        self.upstream = upstream or nullcontext
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "calls": 0, "retries": 0, "errors": 0, "queue_wait": 0.0, "max_queue_wait": 0.0}
+
+    @staticmethod
+    def key(tone, lang, snippet):
+        return hashlib.sha256(f"{tone}\0{lang}\0{snippet}".encode()).hexdigest()
+
+    def generate(self, tone, lang, snippet):
+        key = self.key(tone, lang, snippet)
+        text = self.cache.get(key)
+        if text is not None:
+            self._count("hits")
+            return text
+        with self._lock:
+            leader = key not in self._inflight
+            if leader:
+                self._inflight[key] = Future()
+            future = self._inflight[key]
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+        self._count("misses")
+        try:
+            text = self._call(build_prompt(tone, lang, snippet))
+            self.cache.put(key, text)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _call(self, prompt):
+        for attempt in range(self.retries + 1):
+            waited = self.requests.acquire() + self.tokens.acquire(len(prompt) // 4 + self.output_tokens)
+            with self._lock:
+                self._stats["queue_wait"] += waited
+                self._stats["max_queue_wait"] = max(self._stats["max_queue_wait"], waited)
+            try:
+                self._count("calls")
+                with self.upstream(), metrics.stage("gemini_call"):
+                    return self.model.generate_content(prompt).text
+            except RETRYABLE as e:
+                if attempt == self.retries:
+                    self._count("errors")
+                    raise
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"Gemini retry {attempt + 1}/{self.retries} in {delay:.1f}s: {e}")
+                self._count("retries")
+                time.sleep(delay)
+            except Exception:
+                self._count("errors")
+                raise
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        lookups = s["hits"] + s["misses"] + s["coalesced"]
+        s["hit_rate"] = round((s["hits"] + s["coalesced"]) / lookups, 4) if lookups else 0.0
+        s["avg_queue_wait"] = round(s["queue_wait"] / s["calls"], 4) if s["calls"] else 0.0
+        s["queue_wait"] = round(s["queue_wait"], 4)
+        s["max_queue_wait"] = round(s["max_queue_wait"], 4)
+        s["cached"] = len(self.cache)
+        return s
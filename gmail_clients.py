@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from google.oauth2.credentials import Credentials
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+HTTP_TIMEOUT = 30
+
+_documents = {}
+_documents_lock = threading.Lock()
+_transports = threading.local()
+
+
+def discovery_document(api, version):
+    """Parse the bundled discovery document once per process instead of on every build()."""
+    key = (api, version)
+    if key not in _documents:
+        with _documents_lock:
+            if key not in _documents:
+                _documents[key] = json.loads(discovery_cache.get_static_doc(api, version))
+    return _documents[key]
+
+
+def transport():
+    """This thread's httplib2.Http, shared by every user's AuthorizedHttp on the thread.
+
+    httplib2.Http is not thread-safe, so each thread gets its own; its
+    keep-alive connections to Google are reused across users and passes.
+    """
+    if not hasattr(_transports, "http"):
+        _transports.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return _transports.http
+
+
+def build_service(api, version, creds=None, http=None):
+    if http is None:
+        http = AuthorizedHttp(creds, http=transport())
+    return build_from_document(discovery_document(api, version), http=http)
+
+
+def credentials_for(user):
+    return Credentials(token=user['access_token'], refresh_token=user['refresh_token'], token_uri=TOKEN_URI, client_id=os.getenv("GOOGLE_CLIENT_ID"), client_secret=os.getenv("GOOGLE_CLIENT_SECRET"))
+
+
+class GmailClient:
+    """One user's credentials and Gmail service, authorising requests over the thread's shared transport."""
+
+    def __init__(self, email, creds):
+        self.email = email
+        self.creds = creds
+        self.saved_token = creds.token
+        self._local = threading.local()
+        self.service = build_service("gmail", "v1", http=self.http())
+
+    def http(self):
+        # The AuthorizedHttp wrapper is per user; the connection pool underneath belongs to the thread.
+        if not hasattr(self._local, "http"):
+            self._local.http = AuthorizedHttp(self.creds, http=transport())
+        return self._local.http
+
+    def matches(self, user):
+        return user.get('refresh_token') == self.creds.refresh_token and user.get('access_token') in (self.saved_token, self.creds.token)
+
+
+class GmailClientPool:
+    """Size-bounded LRU of GmailClient objects keyed by email.
+
+    on_refresh(email, token) is called when a client's access token has been
+    refreshed since it was last saved, so the new token can be persisted.
+    """
+
+    def __init__(self, max_size=None, on_refresh=None):
+        self.max_size = max_size or int(os.getenv("GMAIL_CLIENT_CACHE_SIZE", 256))
+        self.on_refresh = on_refresh
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        email = user['email']
+        with self._lock:
+            client = self._clients.get(email)
+            if client is not None and client.matches(user):
+                self._clients.move_to_end(email)
+                return client
+        return self.put(email, credentials_for(user))
+
+    def put(self, email, creds):
+        client = GmailClient(email, creds)
+        with self._lock:
+            self._clients[email] = client
+            self._clients.move_to_end(email)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def invalidate(self, email):
+        with self._lock:
+            self._clients.pop(email, None)
+
+    def persist_token(self, client):
+        token = client.creds.token
+        if not token or token == client.saved_token:
+            return
+        try:
+            if self.on_refresh:
+                self.on_refresh(client.email, token)
+            client.saved_token = token
+        except Exception as e:
+            logger.error(f"Token save error ({client.email}): {e}")
+
+    def __len__(self):
+        return len(self._clients)
@@ -0,0 +1,87 @@
+import logging
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_QUERY = "is:unread"
+FALLBACK_LIMIT = 5
+BATCH_LIMIT = 50
+MODIFY_LIMIT = 1000
+
+
+class HistoryExpired(Exception):
+    pass
+
+
+def list_history_ids(service, start_history_id, http=None, limit=None):
+    """Return (message ids, new historyId) for inbox mail added since start_history_id.
+
+    With a limit, listing stops at the last whole history record that fits and
+    the returned historyId is that record's id, so the rest is picked up from
+    there on the next pass.
+    """
+    ids, page_token, latest = [], None, start_history_id
+    while True:
+        try:
+            res = service.users().history().list(userId="me", startHistoryId=start_history_id, historyTypes="messageAdded", labelId="INBOX", pageToken=page_token).execute(http=http)
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpired(start_history_id)
+            raise
+        for record in res.get("history", []):
+            added = [a.get("message", {}) for a in record.get("messagesAdded", [])]
+            new = [m["id"] for m in added if "UNREAD" in m.get("labelIds", []) and m["id"] not in ids]
+            if limit and ids and len(ids) + len(new) > limit:
+                return ids, latest
+            ids.extend(dict.fromkeys(new))
+            latest = record.get("id", latest)
+        page_token = res.get("nextPageToken")
+        if not page_token:
+            return ids, res.get("historyId", latest)
+
+
+def list_unread_ids(service, http=None):
+    """The original unread listing, plus the historyId to resume incremental sync from."""
+    history_id = service.users().getProfile(userId="me").execute(http=http).get("historyId")
+    res = service.users().messages().list(userId="me", q=FALLBACK_QUERY, maxResults=FALLBACK_LIMIT).execute(http=http)
+    return [m["id"] for m in res.get("messages", [])], history_id
+
+
+def fetch_message_ids(service, history_id=None, http=None, limit=None):
+    if history_id:
+        try:
+            return list_history_ids(service, history_id, http=http, limit=limit)
+        except HistoryExpired:
+            logger.info(f"History {history_id} expired, falling back to unread listing")
+    return list_unread_ids(service, http=http)
+
+
+def batch_get(service, ids, http=None):
+    """Load messages with one batched HTTP request per BATCH_LIMIT ids, keeping id order.
+
+    Returns (messages, failed ids). A message that no longer exists (404) is
+    neither returned nor counted as failed, since there is nothing to retry.
+    """
+    found, failed = {}, []
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            found[request_id] = response
+        elif isinstance(exception, HttpError) and exception.resp.status == 404:
+            logger.info(f"Msg {request_id} is gone")
+        else:
+            logger.error(f"Msg error: {exception}")
+            failed.append(request_id)
+
+    for i in range(0, len(ids), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=collect)
+        for msg_id in ids[i:i + BATCH_LIMIT]:
+            batch.add(service.users().messages().get(userId="me", id=msg_id), request_id=msg_id)
+        batch.execute(http=http)
+    return [found[i] for i in ids if i in found], failed
+
+
+def mark_read(service, ids, http=None):
+    for i in range(0, len(ids), MODIFY_LIMIT):
+        service.users().messages().batchModify(userId="me", body={"ids": ids[i:i + MODIFY_LIMIT], "removeLabelIds": ["UNREAD"]}).execute(http=http)
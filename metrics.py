@@ -0,0 +1,110 @@
+import time
+import threading
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "ernesco"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """Process-wide stage histograms, counters and gauges rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("stage_errors_total", stage=name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._stages.setdefault(name, Histogram()).observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def collector(self, fn):
+        """Register fn() -> {gauge name: value}, read on every render."""
+        self._collectors.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {"count": h.count, "sum": h.sum, "avg": h.sum / h.count if h.count else 0.0} for name, h in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            stages = {name: (list(h.counts), h.count, h.sum, h.buckets) for name, h in self._stages.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        if stages:
+            lines += [f"# HELP {PREFIX}_stage_seconds Latency of each scan pipeline stage.", f"# TYPE {PREFIX}_stage_seconds histogram"]
+            for name, (counts, count, total, buckets) in sorted(stages.items()):
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {count}')
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                    typed.add(name)
+                lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for fn in self._collectors:
+            try:
+                collected = fn()
+            except Exception:
+                continue
+            for name, value in sorted(collected.items()):
+                lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+registry = Metrics()
@@ -0,0 +1,243 @@
+import os
+import math
+import time
+import zlib
+import uuid
+import atexit
+import socket
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+EPOCH = "1970-01-01T00:00:00Z"
+SHARDS = int(os.getenv("SCAN_SHARDS", 16))
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class SupabaseLeaseStore:
+    """Leases, worker heartbeats and queued scan jobs in Supabase.
+
+    Expects scan_leases(shard int primary key, owner text, expires_at timestamptz),
+    scan_workers(owner text primary key, expires_at timestamptz) and
+    scan_jobs(id bigserial, email text, shard int). A claim is a single
+    conditional UPDATE, so only one owner can win an expired lease.
+    """
+
+    def __init__(self, supabase, shards):
+        self.supabase = supabase
+        self.shards = shards
+        self._seeded = False
+
+    def claim(self, shard, owner, ttl):
+        if not self._seeded:
+            self.supabase.table("scan_leases").upsert([{"shard": s, "owner": None, "expires_at": EPOCH} for s in range(self.shards)], on_conflict="shard", ignore_duplicates=True).execute()
+            self._seeded = True
+        now = time.time()
+        res = self.supabase.table("scan_leases").update({"owner": owner, "expires_at": iso(now + ttl)}).eq("shard", shard).or_(f"owner.eq.{owner},expires_at.lt.{iso(now)}").execute()
+        return bool(res.data)
+
+    def release(self, shard, owner):
+        self.supabase.table("scan_leases").update({"owner": None, "expires_at": EPOCH}).eq("shard", shard).eq("owner", owner).execute()
+
+    def heartbeat(self, owner, ttl):
+        self.supabase.table("scan_workers").upsert({"owner": owner, "expires_at": iso(time.time() + ttl)}, on_conflict="owner").execute()
+
+    def live_owners(self):
+        return {r["owner"] for r in self.supabase.table("scan_workers").select("owner").gt("expires_at", iso(time.time())).execute().data}
+
+    def enqueue(self, email, shard):
+        self.supabase.table("scan_jobs").insert({"email": email, "shard": shard}).execute()
+
+    def take_jobs(self, shards):
+        if not shards:
+            return set()
+        rows = self.supabase.table("scan_jobs").select("id,email").in_("shard", list(shards)).execute().data
+        if rows:
+            self.supabase.table("scan_jobs").delete().in_("id", [r["id"] for r in rows]).execute()
+        return {r["email"] for r in rows}
+
+
+class SQLiteLeaseStore:
+    """The same contract on SQLite, for local runs and tests (":memory:" by default)."""
+
+    def __init__(self, path=":memory:", shards=0):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS scan_leases (shard INTEGER PRIMARY KEY, owner TEXT, expires_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS scan_workers (owner TEXT PRIMARY KEY, expires_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS scan_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT, shard INTEGER)")
+            self._db.executemany("INSERT OR IGNORE INTO scan_leases VALUES (?, NULL, 0)", [(s,) for s in range(shards)])
+
+    def claim(self, shard, owner, ttl):
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute("UPDATE scan_leases SET owner = ?, expires_at = ? WHERE shard = ? AND (owner = ? OR expires_at < ?)", (owner, now + ttl, shard, owner, now))
+            return cur.rowcount == 1
+
+    def release(self, shard, owner):
+        with self._lock:
+            self._db.execute("UPDATE scan_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?", (shard, owner))
+
+    def heartbeat(self, owner, ttl):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO scan_workers VALUES (?, ?)", (owner, time.time() + ttl))
+
+    def live_owners(self):
+        with self._lock:
+            return {r[0] for r in self._db.execute("SELECT owner FROM scan_workers WHERE expires_at > ?", (time.time(),))}
+
+    def enqueue(self, email, shard):
+        with self._lock:
+            self._db.execute("INSERT INTO scan_jobs (email, shard) VALUES (?, ?)", (email, shard))
+
+    def take_jobs(self, shards):
+        if not shards:
+            return set()
+        marks = ",".join("?" * len(shards))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute(f"SELECT id, email FROM scan_jobs WHERE shard IN ({marks})", list(shards)).fetchall()
+            self._db.executemany("DELETE FROM scan_jobs WHERE id = ?", [(r[0],) for r in rows])
+            self._db.execute("COMMIT")
+        return {r[1] for r in rows}
+
+
+def make_store(supabase, shards=SHARDS):
+    path = os.getenv("SCAN_LEASE_DB")
+    return SQLiteLeaseStore(path, shards) if path else SupabaseLeaseStore(supabase, shards)
+
+
+class ScanCoordinator:
+    """Splits users into shards and scans only the shards this process holds a lease on.
+
+    heartbeat() renews held leases and rebalances towards an even share of
+    the live workers; scan_due() scans users whose adaptive interval has
+    elapsed or who have a queued job. Busy mailboxes are polled more often
+    (interval halves after a pass with mail), quiet ones back off.
+    on_lost(match) is called with an email predicate when shards are given up.
+    """
+
+    def __init__(self, scanner, store, shards=None, lease_ttl=None, min_interval=None, max_interval=None, owner=None, on_lost=None):
+        env = lambda name, default: int(os.getenv(name, default))
+        self.scanner = scanner
+        self.store = store
+        self.shards = shards or SHARDS
+        self.lease_ttl = lease_ttl or env("SCAN_LEASE_TTL", 90)
+        self.min_interval = min_interval or env("SCAN_MIN_INTERVAL", 60)
+        self.max_interval = max_interval or env("SCAN_MAX_INTERVAL", 900)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.on_lost = on_lost
+        self.held = set()
+        self._scanning = set()
+        self._expires = 0.0
+        self._schedule = {}
+        self._lock = threading.Lock()
+
+    def shard_of(self, email):
+        return zlib.crc32(email.lower().encode()) % self.shards
+
+    def heartbeat(self):
+        before = set(self.held)
+        started = time.time()
+        try:
+            self.store.heartbeat(self.owner, self.lease_ttl)
+            share = math.ceil(self.shards / max(1, len(self.store.live_owners() | {self.owner})))
+            held = {s for s in before if self.store.claim(s, self.owner, self.lease_ttl)}
+            with self._lock:
+                # Shards in the middle of a pass are kept until it ends; a later heartbeat gives them up.
+                excess = sorted(held - self._scanning, reverse=True)[:max(0, len(held) - share)]
+                held.difference_update(excess)
+                self.held = held
+                self._expires = started + self.lease_ttl
+            for shard in excess:
+                self.store.release(shard, self.owner)
+            # Start the search at a per-owner offset so joining workers do not race for the same shards.
+            start = zlib.crc32(self.owner.encode()) % self.shards
+            for shard in ((start + i) % self.shards for i in range(self.shards)):
+                if len(held) >= share:
+                    break
+                if shard not in held and self.store.claim(shard, self.owner, self.lease_ttl):
+                    held.add(shard)
+        except Exception as e:
+            logger.error(f"Lease error: {e}")
+            held = set()
+        with self._lock:
+            lost = before - held
+            self.held = held
+            for email in [e for e in self._schedule if self.shard_of(e) in lost]:
+                del self._schedule[email]
+        if lost and self.on_lost:
+            self.on_lost(lambda email: self.shard_of(email) in lost)
+        return held
+
+    def owns(self, user):
+        """True while this process still holds an unexpired lease on the user's shard."""
+        return self.shard_of(user["email"]) in self.held and time.time() < self._expires
+
+    def enqueue(self, email):
+        self.store.enqueue(email, self.shard_of(email))
+
+    def due_users(self, users, jobs, now):
+        due = []
+        for user in users:
+            email = user.get('email')
+            if not email or not user.get('access_token') or self.shard_of(email) not in self.held:
+                continue
+            interval, next_at = self._schedule.get(email, (self.min_interval, 0))
+            if email in jobs or now >= next_at:
+                due.append(user)
+        return due
+
+    def scan_due(self):
+        with self._lock:
+            held = self._scanning = set(self.held)
+        try:
+            return self._scan_due(held)
+        finally:
+            with self._lock:
+                self._scanning = set()
+
+    def _scan_due(self, held):
+        if not held:
+            return None
+        try:
+            jobs = self.store.take_jobs(held)
+            users = self.scanner.load_users()
+        except Exception as e:
+            logger.error(f"Global error: {e}")
+            return None
+        now = time.time()
+        due = self.due_users(users, jobs, now)
+        if not due:
+            return None
+        summary = self.scanner.scan_users(due, owns=self.owns)
+        with self._lock:
+            for result in summary["users"]:
+                # Users that were not actually scanned keep their schedule and are retried next tick.
+                if result["status"] in ("busy", "timeout", "skipped"):
+                    continue
+                interval = self._schedule.get(result["email"], (self.min_interval, 0))[0]
+                interval = max(self.min_interval, interval / 2) if result["messages"] else min(self.max_interval, interval * 1.5)
+                self._schedule[result["email"]] = (interval, now + interval)
+        return summary
+
+    def release_all(self):
+        for shard in list(self.held):
+            try:
+                self.store.release(shard, self.owner)
+            except Exception as e:
+                logger.error(f"Lease error: {e}")
+        self.held = set()
+
+    def start(self, scheduler, tick=None):
+        tick = tick or int(os.getenv("SCAN_TICK", 15))
+        scheduler.add_job(func=self.heartbeat, trigger="interval", seconds=max(5, self.lease_ttl // 3), max_instances=1, next_run_time=datetime.now())
+        scheduler.add_job(func=self.scan_due, trigger="interval", seconds=tick, max_instances=1, coalesce=True)
+        atexit.register(self.release_all)
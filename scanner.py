@@ -0,0 +1,287 @@
+import os
+import time
+import base64
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from email.message import EmailMessage
+
+import gmail_sync
+from gmail_clients import GmailClientPool
+from gemini_service import GenerationService
+from write_behind import WriteBehindSink
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_COLUMNS = "email,access_token,refresh_token,language,tone,history_id"
+
+
+class ScanLimits:
+    """Concurrency knobs for one scan pass, overridable through SCAN_* env vars."""
+
+    def __init__(self, max_users=8, max_workers=16, per_user=4, gmail=8, gemini=4, supabase=8, user_timeout=120, pass_timeout=280, max_messages=50, retries=3):
+        self.max_users = max_users
+        self.max_workers = max_workers
+        self.per_user = per_user
+        self.upstreams = {"gmail": gmail, "gemini": gemini, "supabase": supabase}
+        self.user_timeout = user_timeout
+        self.pass_timeout = pass_timeout
+        self.max_messages = max_messages
+        self.retries = retries
+
+    @classmethod
+    def from_env(cls):
+        env = lambda name, default: int(os.getenv(name, default))
+        return cls(
+            max_users=env("SCAN_MAX_USERS", 8),
+            max_workers=env("SCAN_MAX_WORKERS", 16),
+            per_user=env("SCAN_PER_USER", 4),
+            gmail=env("SCAN_GMAIL_CONCURRENCY", 8),
+            gemini=env("SCAN_GEMINI_CONCURRENCY", 4),
+            supabase=env("SCAN_SUPABASE_CONCURRENCY", 8),
+            user_timeout=env("SCAN_USER_TIMEOUT", 120),
+            pass_timeout=env("SCAN_PASS_TIMEOUT", 280),
+            max_messages=env("SCAN_MAX_MESSAGES", 50),
+            retries=env("SCAN_MESSAGE_RETRIES", 3),
+        )
+
+
+class ScanEngine:
+    """Runs a per-user job over many users with global, per-user and per-upstream limits.
+
+    Users run on their own pool so a slow account only ties up one slot; their
+    messages share a global pool, gated per user so one busy inbox cannot take
+    every worker. Upstream semaphores cap in-flight calls to Gmail, Gemini and
+    Supabase across the whole pass.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or ScanLimits.from_env()
+        self._upstreams = {name: threading.BoundedSemaphore(n) for name, n in self.limits.upstreams.items()}
+        self._user_pool = ThreadPoolExecutor(max_workers=self.limits.max_users, thread_name_prefix="scan-user")
+        self._msg_pool = ThreadPoolExecutor(max_workers=self.limits.max_workers, thread_name_prefix="scan-msg")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def upstream(self, name):
+        with self._upstreams[name]:
+            yield
+
+    def map_messages(self, items, fn, deadline=None):
+        """Run fn over one user's items on the shared pool, at most per_user at a time."""
+        gate = threading.BoundedSemaphore(self.limits.per_user)
+        futures = []
+
+        def guarded(item):
+            try:
+                return fn(item)
+            finally:
+                gate.release()
+
+        for item in items:
+            if deadline and time.monotonic() > deadline:
+                break
+            gate.acquire()
+            futures.append(self._msg_pool.submit(guarded, item))
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                logger.error(f"Msg error: {e}")
+                results.append(e)
+        return results
+
+    def run(self, users, scan_user):
+        """Scan every user and return a pass summary with one result per user.
+
+        A user whose job from an earlier pass is still running (it outlived
+        that pass's timeout) is reported as busy instead of being scanned twice.
+        """
+        started = time.monotonic()
+        futures = {}
+        results = []
+        with self._lock:
+            for user in users:
+                email = user.get("email")
+                if email in self._inflight:
+                    results.append({"email": email, "status": "busy", "messages": 0, "sent": 0, "failed": 0, "duration": 0.0})
+                    continue
+                future = self._user_pool.submit(self._run_user, user, scan_user)
+                self._inflight[email] = future
+                futures[future] = user
+        for future, user in futures.items():
+            future.add_done_callback(lambda f, email=user.get("email"): self._finished(email, f))
+        done, pending = wait(futures, timeout=self.limits.pass_timeout)
+        results.extend(f.result() for f in done)
+        for f in pending:
+            results.append({"email": futures[f].get("email"), "status": "timeout", "messages": 0, "sent": 0, "failed": 0, "duration": round(time.monotonic() - started, 3)})
+        duration = time.monotonic() - started
+        messages = sum(r["messages"] for r in results)
+        return {
+            "users": results,
+            "duration": round(duration, 3),
+            "messages": messages,
+            "throughput": round(messages / duration, 2) if duration else 0.0,
+        }
+
+    def _finished(self, email, future):
+        with self._lock:
+            if self._inflight.get(email) is future:
+                del self._inflight[email]
+
+    def _run_user(self, user, scan_user):
+        started = time.monotonic()
+        result = {"email": user.get("email"), "status": "ok", "messages": 0, "sent": 0, "failed": 0}
+        try:
+            result.update(scan_user(user, started + self.limits.user_timeout) or {})
+        except Exception as e:
+            logger.error(f"User error ({user.get('email')}): {e}")
+            result.update(status="error", error=str(e))
+        result["duration"] = round(time.monotonic() - started, 3)
+        return result
+
+    def shutdown(self):
+        self._user_pool.shutdown(wait=False, cancel_futures=True)
+        self._msg_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def send_gmail_reply(service, thread_id, msg_id, to_email, subject, body, http=None):
+    try:
+        message = EmailMessage()
+        message.set_content(body)
+        message['To'] = to_email
+        message['Subject'] = subject if subject.lower().startswith("re:") else f"Re: {subject}"
+        message['In-Reply-To'] = msg_id
+        message['References'] = msg_id
+        raw_msg = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        with metrics.stage("gmail_send"):
+            service.users().messages().send(userId="me", body={'raw': raw_msg, 'threadId': thread_id}).execute(http=http)
+        return True
+    except Exception as e:
+        logger.error(f"Send Error: {e}")
+        return False
+
+
+class Scanner:
+    """The inbox -> Gemini -> reply pipeline, run for every profile through a ScanEngine."""
+
+    def __init__(self, supabase, model, engine=None, clients=None, generator=None, logs=None, profiles=None, audio=None):
+        self.supabase = supabase
+        self.audio = audio
+        self.engine = engine or ScanEngine()
+        self.logs = logs or WriteBehindSink(supabase, "activity_logs")
+        self.profiles = profiles or WriteBehindSink(supabase, "profiles")
+        self.generator = generator or GenerationService(model, upstream=lambda: self.engine.upstream("gemini"))
+        self.clients = clients or GmailClientPool(on_refresh=self.save_token)
+        self.incremental = os.getenv("GMAIL_SYNC_MODE", "history") != "list"
+        self._retries = {}
+        self._retries_lock = threading.Lock()
+
+    def save_token(self, email, token):
+        self.profiles.update({"access_token": token}, {"email": email})
+
+    def load_users(self):
+        """Connected profiles, with only the columns a scan reads."""
+        with self.engine.upstream("supabase"):
+            users = self.supabase.table("profiles").select(PROFILE_COLUMNS).execute().data
+        return [u for u in users if u.get('access_token')]
+
+    def scan_all(self):
+        try:
+            users = self.load_users()
+        except Exception as e:
+            logger.error(f"Global error: {e}")
+            return {"users": [], "duration": 0.0, "messages": 0, "throughput": 0.0, "error": str(e)}
+        return self.scan_users(users)
+
+    def scan_users(self, users, owns=None):
+        """Scan users in one pass; owns(user), if given, is rechecked before each user and each send."""
+        with metrics.stage("scan_pass"):
+            summary = self.engine.run(users, lambda user, deadline: self.scan_user(user, deadline, owns))
+        metrics.inc("scan_passes_total")
+        metrics.inc("messages_total", sum(r["sent"] for r in summary["users"]), status="SENT")
+        metrics.inc("messages_total", sum(r["failed"] for r in summary["users"]), status="FAILED")
+        for result in summary["users"]:
+            metrics.inc("users_scanned_total", status=result["status"])
+        metrics.set("last_pass_seconds", summary["duration"])
+        metrics.set("last_pass_throughput", summary["throughput"])
+        logger.info(f"Scan pass: {len(users)} users, {summary['messages']} messages in {summary['duration']}s ({summary['throughput']} msg/s)")
+        return summary
+
+    def scan_user(self, user, deadline=None, owns=None):
+        if owns and not owns(user):
+            return {"status": "skipped"}
+        client = self.clients.get(user)
+        try:
+            with metrics.stage("scan_user"):
+                return self._scan_client(user, client, deadline, owns)
+        finally:
+            self.clients.persist_token(client)
+
+    def _scan_client(self, user, client, deadline, owns=None):
+        service, http = client.service, client.http()
+        with self.engine.upstream("gmail"):
+            with metrics.stage("gmail_list"):
+                listed, history_id = gmail_sync.fetch_message_ids(service, user.get('history_id') if self.incremental else None, http=http, limit=self.engine.limits.max_messages)
+            ids = list(dict.fromkeys(self.retry_ids(user['email']) + listed))
+            # Refetched ids that were already handled come back without UNREAD and are skipped.
+            with metrics.stage("gmail_get"):
+                fetched, failed = gmail_sync.batch_get(service, ids, http=http) if ids else ([], [])
+        messages = [m for m in fetched if "UNREAD" in m.get("labelIds", [])]
+        outcomes = self.engine.map_messages(messages, lambda m: self.process_message(user, client, m, owns), deadline)
+        handled = [m['id'] for m, o in zip(messages, outcomes) if o in ("SENT", "FAILED")]
+        if handled:
+            with self.engine.upstream("gmail"), metrics.stage("gmail_modify"):
+                gmail_sync.mark_read(service, handled, http=http)
+        # Failed gets, errors and messages the deadline cut off stay UNREAD and are retried by id;
+        # the cursor moves past them so one bad message cannot hold back the rest of the inbox.
+        unfinished = failed + [m['id'] for m, o in zip(messages, outcomes) if o not in ("SENT", "FAILED", "SKIPPED")] + [m['id'] for m in messages[len(outcomes):]]
+        self.set_retries(user['email'], unfinished)
+        # A user lost to another worker mid-pass keeps its cursor; the new owner lists from there.
+        if self.incremental and history_id and history_id != user.get('history_id') and "SKIPPED" not in outcomes:
+            self.profiles.update({"history_id": history_id}, {"email": user['email']})
+        sent, skipped = outcomes.count("SENT"), outcomes.count("SKIPPED")
+        return {"messages": len(outcomes) - skipped, "sent": sent, "failed": len(outcomes) - sent - skipped}
+
+    def retry_ids(self, email):
+        with self._retries_lock:
+            return list(self._retries.get(email, {}))
+
+    def set_retries(self, email, ids):
+        """Replace a user's retry set with ids, giving up on any that used up their attempts."""
+        with self._retries_lock:
+            attempts = self._retries.pop(email, {})
+            pending = {}
+            for msg_id in ids:
+                count = attempts.get(msg_id, 0) + 1
+                if count > self.engine.limits.retries:
+                    logger.warning(f"Giving up on message {msg_id} ({email}) after {count - 1} retries")
+                else:
+                    pending[msg_id] = count
+            if pending:
+                self._retries[email] = pending
+
+    def process_message(self, user, client, m, owns=None):
+        lang = user.get('language', 'en')
+        tone = user.get('tone', 'professional')
+        headers = m.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
+        msg_id = next((h['value'] for h in headers if h['name'] == 'Message-ID'), "")
+        with metrics.stage("gemini_generate"):
+            reply = self.generator.generate(tone, lang, m.get('snippet', ''))
+        # Another worker may have taken this user over while the reply was generated.
+        if owns and not owns(user):
+            return "SKIPPED"
+        with self.engine.upstream("gmail"):
+            success = send_gmail_reply(client.service, m['threadId'], msg_id, sender, subject, reply, http=client.http())
+        status_text = "SENT" if success else "FAILED"
+        metrics.inc("replies_total", status=status_text)
+        self.logs.add({"email": user['email'], "subject": subject, "ai_reply": reply, "status": status_text})
+        if self.audio:
+            self.audio.prerender(reply, lang)
+        return status_text
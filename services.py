@@ -0,0 +1,117 @@
+import os
+import logging
+import threading
+
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+_instances = {}
+_lock = threading.RLock()
+
+
+def _lazy(name, factory):
+    # Heavy SDKs are imported inside the factories, so a process only pays for what it uses.
+    if name not in _instances:
+        with _lock:
+            if name not in _instances:
+                _instances[name] = factory()
+                logger.info(f"Initialised {name}")
+    return _instances[name]
+
+
+def created(name):
+    return _instances.get(name)
+
+
+def supabase():
+    def make():
+        from supabase import create_client
+        return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    return _lazy("supabase", make)
+
+
+def model():
+    def make():
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        return genai.GenerativeModel('gemini-1.5-flash')
+    return _lazy("model", make)
+
+
+def stats():
+    def make():
+        from activity import ActivityStats
+        return ActivityStats(supabase())
+    return _lazy("stats", make)
+
+
+def profiles():
+    def make():
+        from write_behind import WriteBehindSink
+        sink = WriteBehindSink(supabase(), "profiles")
+        metrics.collector(lambda: {f"write_behind_{k}_profiles": sink.status()[k] for k in ("queued", "spill_file", "failed_batches")})
+        return sink
+    return _lazy("profiles", make)
+
+
+def audio():
+    def make():
+        from audio_cache import AudioCache
+        cache = AudioCache()
+        metrics.collector(lambda: {f"audio_{k}": v for k, v in cache.stats().items()})
+        return cache
+    return _lazy("audio", make)
+
+
+def prerender_cache():
+    """The audio cache replies are pre-rendered into, or None if the web process could not read it.
+
+    /listen runs in the web process, so pre-rendering only helps when the
+    scanner is embedded there or AUDIO_CACHE_DIR names a directory both
+    processes mount. Otherwise the web process renders on first request.
+    """
+    if os.getenv("EMBEDDED_SCANNER") == "1" or os.getenv("AUDIO_CACHE_DIR"):
+        return audio()
+    logger.warning("AUDIO_CACHE_DIR is not set; skipping audio pre-rendering in the worker")
+    return None
+
+
+def scanner():
+    def make():
+        from scanner import Scanner
+        from write_behind import WriteBehindSink
+        logs = WriteBehindSink(supabase(), "activity_logs", on_write=stats().record)
+        instance = Scanner(supabase(), model(), logs=logs, profiles=profiles(), audio=prerender_cache())
+        metrics.collector(lambda: {f"gemini_{k}": v for k, v in instance.generator.stats().items()})
+        metrics.collector(lambda: {f"write_behind_{k}_activity_logs": logs.status()[k] for k in ("queued", "spill_file", "failed_batches")})
+        return instance
+    return _lazy("scanner", make)
+
+
+def coordinator(with_scanner=False):
+    def make():
+        from scan_scheduler import ScanCoordinator, make_store
+        # Only a process that has recorded stats has counters to drop.
+        instance = ScanCoordinator(None, make_store(supabase()), on_lost=lambda match: created("stats") and created("stats").forget(match))
+        metrics.collector(lambda: {"scan_shards_held": len(instance.held)})
+        return instance
+    instance = _lazy("coordinator", make)
+    if with_scanner and instance.scanner is None:
+        instance.scanner = scanner()
+    return instance
+
+
+def status():
+    """Stats for whichever components this process has initialised."""
+    out = {}
+    if created("scanner"):
+        out["gemini"] = created("scanner").generator.stats()
+        out["writes"] = [created("scanner").logs.status()]
+    if created("profiles"):
+        out.setdefault("writes", []).append(created("profiles").status())
+    if created("audio"):
+        out["audio"] = created("audio").stats()
+    if created("coordinator"):
+        out["shards"] = sorted(created("coordinator").held)
+    return out
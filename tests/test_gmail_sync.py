@@ -0,0 +1,103 @@
+import httplib2
+import pytest
+from types import SimpleNamespace
+from googleapiclient.errors import HttpError
+
+import gmail_sync
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+class Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, http=None):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class Batch:
+    def __init__(self, service, callback):
+        self.service, self.callback, self.ids = service, callback, []
+
+    def add(self, request, request_id):
+        self.ids.append(request_id)
+
+    def execute(self, http=None):
+        for msg_id in self.ids:
+            result = self.service.messages.get(msg_id, http_error(404))
+            if isinstance(result, Exception):
+                self.callback(msg_id, None, result)
+            else:
+                self.callback(msg_id, result, None)
+
+
+class Service:
+    def __init__(self, pages=(), messages=None, unread=()):
+        self.pages = list(pages)
+        self.messages = messages or {}
+        self.unread = list(unread)
+
+    def new_batch_http_request(self, callback):
+        return Batch(self, callback)
+
+    def page(self, **kwargs):
+        page = self.pages[int(kwargs.get("pageToken") or 0)]
+        return Request(page)
+
+    def users(self):
+        return SimpleNamespace(
+            history=lambda: SimpleNamespace(list=self.page),
+            messages=lambda: SimpleNamespace(
+                get=lambda userId, id: None,
+                list=lambda **kwargs: Request({"messages": [{"id": i} for i in self.unread[:kwargs["maxResults"]]]}),
+            ),
+            getProfile=lambda userId: Request({"historyId": "500"}),
+        )
+
+
+def record(history_id, *ids):
+    return {"id": history_id, "messagesAdded": [{"message": {"id": i, "labelIds": ["INBOX", "UNREAD"]}} for i in ids]}
+
+
+PAGES = [
+    {"history": [record("11", "a", "b"), record("12", "c")], "nextPageToken": "1", "historyId": "99"},
+    {"history": [record("13", "d"), {"id": "14", "messagesAdded": [{"message": {"id": "e", "labelIds": ["INBOX"]}}]}], "historyId": "99"},
+]
+
+
+def test_history_without_limit_returns_everything_and_the_mailbox_cursor():
+    assert gmail_sync.list_history_ids(Service(PAGES), "10") == (["a", "b", "c", "d"], "99")
+
+
+@pytest.mark.parametrize("limit, expected", [
+    (1, (["a", "b"], "11")),
+    (2, (["a", "b"], "11")),
+    (3, (["a", "b", "c"], "12")),
+    (4, (["a", "b", "c", "d"], "99")),
+])
+def test_history_limit_stops_at_the_last_whole_record(limit, expected):
+    assert gmail_sync.list_history_ids(Service(PAGES), "10", limit=limit) == expected
+
+
+def test_expired_history_falls_back_to_unread_listing():
+    service = Service([http_error(404)], unread=[str(i) for i in range(10)])
+    ids, history_id = gmail_sync.fetch_message_ids(service, "10")
+    assert ids == ["0", "1", "2", "3", "4"]
+    assert history_id == "500"
+
+
+def test_other_history_errors_are_raised():
+    with pytest.raises(HttpError):
+        gmail_sync.fetch_message_ids(Service([http_error(500)]), "10")
+
+
+def test_batch_get_treats_missing_messages_as_gone_and_reports_failures():
+    service = Service(messages={"a": {"id": "a"}, "c": http_error(500), "d": {"id": "d"}})
+    messages, failed = gmail_sync.batch_get(service, ["d", "a", "b", "c"])
+    assert [m["id"] for m in messages] == ["d", "a"]
+    assert failed == ["c"]
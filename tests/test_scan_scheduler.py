@@ -0,0 +1,133 @@
+import time
+
+from scan_scheduler import ScanCoordinator, SQLiteLeaseStore
+
+
+class FakeScanner:
+    def __init__(self, users, during=None):
+        self.users = users
+        self.during = during
+        self.scanned = []
+
+    def load_users(self):
+        return self.users
+
+    def scan_users(self, users, owns=None):
+        if self.during:
+            self.during()
+        self.scanned.append([u["email"] for u in users])
+        return {"users": [{"email": u["email"], "status": "ok" if owns(u) else "skipped", "messages": 0} for u in users]}
+
+
+def test_claim_is_exclusive_until_expiry():
+    store = SQLiteLeaseStore(shards=2)
+    assert store.claim(0, "a", ttl=60)
+    assert store.claim(0, "a", ttl=60)
+    assert not store.claim(0, "b", ttl=60)
+    store.release(0, "a")
+    assert store.claim(0, "b", ttl=60)
+
+
+def test_expired_lease_can_be_taken_over():
+    store = SQLiteLeaseStore(shards=1)
+    assert store.claim(0, "a", ttl=-1)
+    assert store.claim(0, "b", ttl=60)
+    assert not store.claim(0, "a", ttl=60)
+
+
+def test_release_only_by_owner():
+    store = SQLiteLeaseStore(shards=1)
+    store.claim(0, "a", ttl=60)
+    store.release(0, "b")
+    assert not store.claim(0, "b", ttl=60)
+
+
+def test_live_owners_drop_expired_workers():
+    store = SQLiteLeaseStore()
+    store.heartbeat("a", 60)
+    store.heartbeat("b", -1)
+    assert store.live_owners() == {"a"}
+
+
+def test_take_jobs_only_returns_and_removes_held_shards():
+    store = SQLiteLeaseStore(shards=4)
+    store.enqueue("x@example.com", 1)
+    store.enqueue("x@example.com", 1)
+    store.enqueue("y@example.com", 2)
+    assert store.take_jobs(set()) == set()
+    assert store.take_jobs({1, 3}) == {"x@example.com"}
+    assert store.take_jobs({1}) == set()
+    assert store.take_jobs({2}) == {"y@example.com"}
+
+
+def test_heartbeat_rebalances_to_an_even_share():
+    store = SQLiteLeaseStore(shards=8)
+    first = ScanCoordinator(None, store, shards=8, owner="first")
+    assert first.heartbeat() == set(range(8))
+    second = ScanCoordinator(None, store, shards=8, owner="second")
+    assert second.heartbeat() == set()
+    assert len(first.heartbeat()) == 4
+    assert len(second.heartbeat()) == 4
+    assert first.held.isdisjoint(second.held)
+
+
+def test_lost_shards_are_reported():
+    store = SQLiteLeaseStore(shards=2)
+    lost = []
+    coordinator = ScanCoordinator(None, store, shards=2, owner="a", on_lost=lost.append)
+    coordinator.heartbeat()
+    store.heartbeat("b", 60)
+    coordinator.heartbeat()
+    assert len(coordinator.held) == 1
+    gone = next(e for e in ("u%d@example.com" % i for i in range(50)) if coordinator.shard_of(e) not in coordinator.held)
+    assert lost and lost[0](gone)
+
+
+def test_shards_are_not_released_mid_scan():
+    store = SQLiteLeaseStore(shards=4)
+    users = [{"email": f"user{i}@example.com", "access_token": "token"} for i in range(20)]
+    held_during = []
+
+    def rebalance():
+        for owner in ("b", "c", "d"):
+            store.heartbeat(owner, 60)
+        held_during.append(set(coordinator.heartbeat()))
+
+    coordinator = ScanCoordinator(FakeScanner(users, during=rebalance), store, shards=4, owner="a")
+    coordinator.heartbeat()
+    summary = coordinator.scan_due()
+    assert held_during == [set(range(4))]
+    assert {r["status"] for r in summary["users"]} == {"ok"}
+    assert len(coordinator.heartbeat()) == 1
+
+
+def test_users_on_lost_shards_are_skipped():
+    store = SQLiteLeaseStore(shards=2)
+    users = [{"email": f"user{i}@example.com", "access_token": "token"} for i in range(10)]
+
+    def steal():
+        # Another worker takes over shard 0 after this worker's lease expired.
+        store.claim(0, "a", ttl=-1)
+        store.claim(0, "b", ttl=60)
+        coordinator.heartbeat()
+
+    coordinator = ScanCoordinator(FakeScanner(users, during=steal), store, shards=2, owner="a")
+    coordinator.heartbeat()
+    summary = coordinator.scan_due()
+    for result in summary["users"]:
+        assert result["status"] == ("skipped" if coordinator.shard_of(result["email"]) == 0 else "ok")
+
+
+def test_due_users_and_jobs():
+    store = SQLiteLeaseStore(shards=1)
+    users = [{"email": "a@example.com", "access_token": "token"}, {"email": "b@example.com", "access_token": "token"}, {"email": "c@example.com"}]
+    scanner = FakeScanner(users)
+    coordinator = ScanCoordinator(scanner, store, shards=1, owner="a", min_interval=60)
+    coordinator.heartbeat()
+    coordinator.scan_due()
+    assert scanner.scanned == [["a@example.com", "b@example.com"]]
+    assert coordinator.scan_due() is None
+    coordinator.enqueue("b@example.com")
+    coordinator.scan_due()
+    assert scanner.scanned[-1] == ["b@example.com"]
+    assert coordinator._schedule["b@example.com"][1] > time.time()
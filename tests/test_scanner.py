@@ -0,0 +1,136 @@
+import httplib2
+from types import SimpleNamespace
+from googleapiclient.errors import HttpError
+
+from scanner import Scanner, ScanEngine, ScanLimits
+from gemini_service import GenerationService
+
+
+class Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, http=None):
+        return self.result() if callable(self.result) else self.result
+
+
+class Mailbox:
+    """Inbox with one history record per message; `errors` maps an id to the status its get fails with."""
+
+    def __init__(self, count, errors=None):
+        self.labels = {f"m{i}": ["INBOX", "UNREAD"] for i in range(count)}
+        self.errors = errors or {}
+        self.gets = []
+
+    def history(self, startHistoryId, **kwargs):
+        records = [{"id": str(n + 2), "messagesAdded": [{"message": {"id": f"m{n}", "labelIds": ["INBOX", "UNREAD"]}}]}
+                   for n in range(len(self.labels)) if n + 2 > int(startHistoryId)]
+        return Request({"history": records, "historyId": str(len(self.labels) + 1)})
+
+    def get(self, msg_id):
+        self.gets.append(msg_id)
+        if msg_id in self.errors:
+            return HttpError(httplib2.Response({"status": self.errors[msg_id]}), b"")
+        return {"id": msg_id, "threadId": msg_id, "labelIds": list(self.labels[msg_id]), "snippet": msg_id, "payload": {"headers": []}}
+
+    def new_batch_http_request(self, callback):
+        ids = []
+
+        def execute(http=None):
+            for msg_id in ids:
+                result = self.get(msg_id)
+                callback(msg_id, None, result) if isinstance(result, Exception) else callback(msg_id, result, None)
+        return SimpleNamespace(add=lambda request, request_id: ids.append(request_id), execute=execute)
+
+    def modify(self, body):
+        for msg_id in body["ids"]:
+            self.labels[msg_id].remove("UNREAD")
+        return {}
+
+    def unread(self):
+        return [i for i, labels in self.labels.items() if "UNREAD" in labels]
+
+    def users(self):
+        messages = SimpleNamespace(get=lambda userId, id: None, send=lambda userId, body: Request({}),
+                                   batchModify=lambda userId, body: Request(lambda: self.modify(body)))
+        return SimpleNamespace(history=lambda: SimpleNamespace(list=self.history), messages=lambda: messages)
+
+
+class Model:
+    def __init__(self, blocked=()):
+        self.blocked = blocked
+
+    def generate_content(self, prompt):
+        if any(snippet in prompt for snippet in self.blocked):
+            raise ValueError("response was blocked")
+        return SimpleNamespace(text="Thanks")
+
+
+class Profiles:
+    def __init__(self, user):
+        self.user = user
+
+    def update(self, values, match):
+        self.user.update(values)
+
+
+def make_scanner(mailbox, user, model=None):
+    engine = ScanEngine(ScanLimits(max_messages=50, retries=2))
+    generator = GenerationService(model or Model(), rpm=10 ** 6, tpm=10 ** 9, upstream=lambda: engine.upstream("gemini"))
+    clients = SimpleNamespace(get=lambda u: SimpleNamespace(email=u["email"], service=mailbox, http=lambda: None), persist_token=lambda c: None)
+    return Scanner(None, None, engine=engine, clients=clients, generator=generator, logs=SimpleNamespace(add=lambda row: None), profiles=Profiles(user))
+
+
+def test_cursor_moves_past_a_deleted_message():
+    mailbox = Mailbox(70, errors={"m3": 404})
+    user = {"email": "a@example.com", "history_id": "1"}
+    scanner = make_scanner(mailbox, user)
+    passes = [scanner.scan_user(user)["sent"] for _ in range(3)]
+    assert passes == [49, 20, 0]
+    assert mailbox.unread() == ["m3"]
+    assert user["history_id"] == "71"
+    assert mailbox.gets.count("m0") == 1
+
+
+def test_failed_get_is_retried_by_id_then_given_up():
+    mailbox = Mailbox(3, errors={"m1": 500})
+    user = {"email": "a@example.com", "history_id": "1"}
+    scanner = make_scanner(mailbox, user)
+    scanner.scan_user(user)
+    assert user["history_id"] == "4"
+    assert scanner.retry_ids(user["email"]) == ["m1"]
+    del mailbox.errors["m1"]
+    assert scanner.scan_user(user)["sent"] == 1
+    assert mailbox.unread() == []
+    assert scanner.retry_ids(user["email"]) == []
+
+
+def test_retries_are_capped():
+    mailbox = Mailbox(1, errors={"m0": 500})
+    user = {"email": "a@example.com", "history_id": "1"}
+    scanner = make_scanner(mailbox, user)
+    for _ in range(5):
+        scanner.scan_user(user)
+    assert mailbox.gets.count("m0") == 3
+    assert scanner.retry_ids(user["email"]) == []
+
+
+def test_blocked_generation_stays_unread_without_holding_the_cursor():
+    mailbox = Mailbox(3)
+    user = {"email": "a@example.com", "history_id": "1"}
+    scanner = make_scanner(mailbox, user, Model(blocked=["m1"]))
+    result = scanner.scan_user(user)
+    assert (result["sent"], result["failed"]) == (2, 1)
+    assert mailbox.unread() == ["m1"]
+    assert user["history_id"] == "4"
+    assert scanner.retry_ids(user["email"]) == ["m1"]
+
+
+def test_cursor_is_kept_when_the_user_is_lost_mid_pass():
+    mailbox = Mailbox(2)
+    user = {"email": "a@example.com", "history_id": "1"}
+    scanner = make_scanner(mailbox, user)
+    checks = iter([True, False, False])
+    scanner.scan_user(user, owns=lambda u: next(checks))
+    assert user["history_id"] == "1"
+    assert mailbox.unread() == ["m0", "m1"]
@@ -0,0 +1,127 @@
+import os
+import json
+import subprocess
+
+import pytest
+
+from write_behind import WriteBehindSink
+
+
+class Query:
+    def __init__(self, db, table, op, payload):
+        self.db, self.table, self.op, self.payload, self.match = db, table, op, payload, {}
+
+    def eq(self, column, value):
+        self.match[column] = value
+        return self
+
+    def execute(self):
+        if self.db.down:
+            raise ConnectionError("supabase is down")
+        if self.op == "insert":
+            self.db.inserted.extend(self.payload)
+        else:
+            self.db.rows.setdefault(tuple(sorted(self.match.items())), {}).update(self.payload)
+
+
+class Supabase:
+    """Records inserts and applies updates in order; raises while `down` is set."""
+
+    def __init__(self):
+        self.down = False
+        self.inserted = []
+        self.rows = {}
+
+    def table(self, name):
+        return type("Table", (), {
+            "insert": lambda _, rows: Query(self, name, "insert", rows),
+            "update": lambda _, values: Query(self, name, "update", values),
+        })()
+
+
+@pytest.fixture
+def db():
+    return Supabase()
+
+
+@pytest.fixture
+def make_sink(db, tmp_path):
+    sinks = []
+
+    def make(table="activity_logs"):
+        sink = WriteBehindSink(db, table, batch_size=100, flush_interval=60, spill_dir=str(tmp_path))
+        sinks.append(sink)
+        return sink
+    yield make
+    db.down = False
+    for sink in sinks:
+        sink.close()
+
+
+def read_spill(path):
+    with open(path, encoding="utf-8") as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_failed_inserts_are_spilled_and_replayed_once(db, make_sink):
+    sink = make_sink()
+    db.down = True
+    sink.add({"n": 1})
+    sink.add({"n": 2})
+    sink.flush()
+    assert [r["row"] for r in read_spill(sink.spill_path)] == [{"n": 1}, {"n": 2}]
+    assert sink.pending() == {"queued": 0, "spill_file": 2}
+
+    db.down = False
+    sink.add({"n": 3})
+    sink.flush()
+    sink.flush()
+    assert sorted(r["n"] for r in db.inserted) == [1, 2, 3]
+    assert not os.path.exists(sink.spill_path)
+    assert sink.status()["replayed"] == 2
+
+
+def test_spilled_update_does_not_overwrite_a_newer_one(db, make_sink):
+    sink = make_sink("profiles")
+    db.down = True
+    sink.update({"history_id": "1", "access_token": "old"}, {"email": "a"})
+    sink.flush()
+    db.down = False
+    sink.update({"access_token": "new"}, {"email": "a"})
+    sink.flush()
+    assert db.rows[(("email", "a"),)] == {"access_token": "new", "history_id": "1"}
+    assert not os.path.exists(sink.spill_path)
+
+
+def test_newer_update_that_also_failed_still_wins(db, make_sink):
+    sink = make_sink("profiles")
+    db.down = True
+    sink.update({"access_token": "old"}, {"email": "a"})
+    sink.flush()
+    sink.update({"access_token": "new"}, {"email": "a"})
+    sink.flush()
+    db.down = False
+    sink.add({"n": 1})
+    sink.flush()
+    assert db.rows[(("email", "a"),)] == {"access_token": "new"}
+
+
+def test_replay_left_by_a_dead_process_is_adopted(db, tmp_path, make_sink):
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    orphan = tmp_path / f"activity_logs.jsonl.{dead.pid}.replay"
+    orphan.write_text(json.dumps({"op": "insert", "row": {"n": 1}}) + "\n", encoding="utf-8")
+    sink = make_sink()
+    assert not orphan.exists()
+    assert sink.pending()["spill_file"] == 1
+    sink.add({"n": 2})
+    sink.flush()
+    assert sorted(r["n"] for r in db.inserted) == [1, 2]
+
+
+def test_replay_of_a_live_process_is_counted_but_left_alone(db, tmp_path, make_sink):
+    live = tmp_path / f"activity_logs.jsonl.{os.getppid()}.replay"
+    live.write_text(json.dumps({"op": "insert", "row": {"n": 1}}) + "\n", encoding="utf-8")
+    sink = make_sink()
+    assert live.exists()
+    assert sink.pending()["spill_file"] == 1
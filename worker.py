@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import logging
+import threading
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from dotenv import load_dotenv
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+import services
+from metrics import registry as metrics
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def metrics_app(environ, start_response):
+    if environ.get("PATH_INFO") == "/metrics":
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4")])
+        return [metrics.render().encode()]
+    if environ.get("PATH_INFO") == "/health":
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps({"status": "healthy", "app": "Ernesco Scan Worker", **services.status()}).encode()]
+    start_response("404 Not Found", [("Content-Type", "text/plain")])
+    return [b"Not found"]
+
+
+def serve_metrics(port):
+    server = make_server("0.0.0.0", port, metrics_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="worker-metrics", daemon=True).start()
+    return server
+
+
+def start(scheduler):
+    """Build the scan pipeline and put its lease heartbeat and scan jobs on `scheduler`."""
+    coordinator = services.coordinator(with_scanner=True)
+    coordinator.start(scheduler)
+    return coordinator
+
+
+def start_background():
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler()
+    start(scheduler)
+    scheduler.start()
+    return scheduler
+
+
+def main():
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    port = os.getenv("WORKER_METRICS_PORT")
+    if port:
+        serve_metrics(int(port))
+        logger.info(f"Worker metrics on port {port}")
+    scheduler = BlockingScheduler()
+    coordinator = start(scheduler)
+    logger.info(f"Scan worker {coordinator.owner} starting")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+SPILL_DIR = os.getenv("WRITE_BEHIND_DIR", "spill")
+REPLAY_RETRY = 30
+
+
+class WriteBehindSink:
+    """Buffers writes to one Supabase table and flushes them off the request/scan path.
+
+    Inserts are sent as one bulk insert once `batch_size` rows are queued or
+    `flush_interval` seconds have passed. Updates are coalesced per match key
+    (the latest values win). Anything Supabase rejects is appended to a JSONL
+    spill file and replayed on the next successful flush, skipping columns a
+    newer update has already set. Replay files left by a process that died are
+    folded back into the spill at startup, and everything left is flushed at
+    interpreter exit.
+    """
+
+    def __init__(self, supabase, table, batch_size=None, flush_interval=None, spill_dir=SPILL_DIR, on_write=None):
+        self.supabase = supabase
+        self.table = table
+        self.batch_size = batch_size or int(os.getenv("WRITE_BEHIND_BATCH", 50))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_INTERVAL", 2.0))
+        self.spill_path = os.path.join(spill_dir, f"{table}.jsonl")
+        self.on_write = on_write
+        self._rows = []
+        self._updates = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._failed_at = 0.0
+        self._stats = {"written": 0, "updated": 0, "batches": 0, "failed_batches": 0, "spilled": 0, "replayed": 0, "last_error": None, "last_flush": None}
+        self._adopt()
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{table}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, row):
+        with self._cond:
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def update(self, values, match):
+        key = tuple(sorted(match.items()))
+        with self._cond:
+            self._updates.setdefault(key, {}).update(values)
+
+    def _run(self):
+        while not self._closed:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or len(self._rows) >= self.batch_size, timeout=self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows = self._rows, []
+                updates, self._updates = self._updates, {}
+            for i in range(0, len(rows), self.batch_size):
+                self._insert(rows[i:i + self.batch_size])
+            applied = {key: values for key, values in updates.items() if self._update(values, dict(key))}
+            if os.path.exists(self.spill_path) and (not self._stats["last_error"] or time.monotonic() - self._failed_at > REPLAY_RETRY):
+                self._replay(applied)
+            self._stats["last_flush"] = time.time()
+
+    def _insert(self, rows, spill=True):
+        try:
+            with metrics.stage("supabase_insert"):
+                self.supabase.table(self.table).insert(rows).execute()
+        except Exception as e:
+            self._failed(e, [{"op": "insert", "row": r} for r in rows] if spill else None)
+            return False
+        self._stats["batches"] += 1
+        self._stats["written"] += len(rows)
+        self._stats["last_error"] = None
+        if self.on_write:
+            try:
+                self.on_write(rows)
+            except Exception as e:
+                logger.error(f"Write hook error ({self.table}): {e}")
+        return True
+
+    def _update(self, values, match, spill=True):
+        try:
+            query = self.supabase.table(self.table).update(values)
+            for column, value in match.items():
+                query = query.eq(column, value)
+            with metrics.stage("supabase_update"):
+                query.execute()
+        except Exception as e:
+            self._failed(e, [{"op": "update", "values": values, "match": match}] if spill else None)
+            return False
+        self._stats["updated"] += 1
+        self._stats["last_error"] = None
+        return True
+
+    def _failed(self, error, records):
+        logger.error(f"Write-behind error ({self.table}): {error}")
+        self._stats["failed_batches"] += 1
+        self._failed_at = time.monotonic()
+        self._stats["last_error"] = str(error)
+        if records:
+            self._spill(records)
+
+    def _spill(self, records):
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as fp:
+            for record in records:
+                fp.write(json.dumps(record) + "\n")
+        self._stats["spilled"] += len(records)
+
+    def _replay(self, applied=None):
+        # Renaming claims the file, so only one process replays a given spill.
+        claimed = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spill_path, claimed)
+        except FileNotFoundError:
+            return
+        with open(claimed, encoding="utf-8") as fp:
+            records = [json.loads(line) for line in fp if line.strip()]
+        inserts = [r["row"] for r in records if r["op"] == "insert"]
+        left = []
+        for i in range(0, len(inserts), self.batch_size):
+            if not self._insert(inserts[i:i + self.batch_size], spill=False):
+                left.extend({"op": "insert", "row": r} for r in inserts[i:])
+                break
+        skipped = 0
+        for r in records:
+            if r["op"] != "update":
+                continue
+            values = self._stale_removed(r, applied or {})
+            if not values:
+                skipped += 1
+            elif left or not self._update(values, r["match"], spill=False):
+                left.append(dict(r, values=values))
+        if left:
+            self._spill(left)
+        self._stats["replayed"] += len(records) - len(left) - skipped
+        os.remove(claimed)
+
+    def _stale_removed(self, record, applied):
+        """Drop the columns of a spilled update that a newer update for the same row already set."""
+        key = tuple(sorted(record["match"].items()))
+        with self._cond:
+            newer = set(self._updates.get(key, ())) | set(applied.get(key, ()))
+        return {k: v for k, v in record["values"].items() if k not in newer}
+
+    def _adopt(self):
+        # A process that died mid-replay leaves its claimed file behind; fold it back into the spill.
+        for path in glob.glob(f"{glob.escape(self.spill_path)}.*.replay"):
+            pid = path.rsplit(".", 2)[-2]
+            if not pid.isdigit() or _alive(int(pid)):
+                continue
+            claimed = f"{self.spill_path}.{os.getpid()}.adopt"
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(claimed, encoding="utf-8") as src, open(self.spill_path, "a", encoding="utf-8") as dst:
+                dst.writelines(line for line in src if line.strip())
+            os.remove(claimed)
+            logger.info(f"Adopted orphaned replay {path}")
+
+    def pending(self):
+        spilled = 0
+        for path in [self.spill_path] + glob.glob(f"{glob.escape(self.spill_path)}.*.replay"):
+            try:
+                with open(path, encoding="utf-8") as fp:
+                    spilled += sum(1 for _ in fp)
+            except FileNotFoundError:
+                continue
+        return {"queued": len(self._rows) + len(self._updates), "spill_file": spilled}
+
+    def status(self):
+        return dict(self._stats, table=self.table, **self.pending())
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True